@@ -19,13 +19,26 @@ Date:
 """
 import argparse
 import os
-import geopandas as gpd
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-import numpy as np
-import pandas as pd
-from scipy import ndimage
-from shapely.geometry import Point
+import tempfile
+from helpers import get_save_kwargs, read_csv_to_df
+
+# Directory in which parsed world maps are cached between runs.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sttd')
+
+# Smoothing sigma at and above which the Gaussian is applied by FFT convolution.
+FFT_SMOOTHING_THRESHOLD = 8
+
+# Equivalent numpy padding modes for the scipy.ndimage boundary modes.
+PAD_MODES = {
+    'reflect': 'symmetric',
+    'grid-mirror': 'symmetric',
+    'mirror': 'reflect',
+    'nearest': 'edge',
+    'wrap': 'wrap',
+    'grid-wrap': 'wrap',
+    'constant': 'constant',
+    'grid-constant': 'constant',
+}
 
 def parse_args():
     """
@@ -78,7 +91,8 @@ def parse_args():
     parser.add_argument('--crs',
                         type=str,
                         default='epsg:4326',
-                        help='Coordinate reference system to use. Default is "EPSG:4326".')
+                        help='Deprecated and ignored; the heatmap is binned directly from the latitude\
+                        and longitude columns. Default is "EPSG:4326".')
     parser.add_argument('--dpi',
                         type=int,
                         default=300,
@@ -87,6 +101,11 @@ def parse_args():
                         type=str,
                         default='grey',
                         help='Edge color of the world map. Default is "grey".')
+    parser.add_argument('--fast-histogram',
+                        action='store_true',
+                        help='Bin the coordinates with fast-histogram, if installed, instead of numpy.\
+                        Faster for large numbers of bins, but points lying exactly on a bin edge may\
+                        fall in a different bin than with numpy. Default is False.')
     parser.add_argument('--fig-size',
                         type=int,
                         nargs=2,
@@ -145,49 +164,182 @@ def parse_args():
 
 def get_world_map(map_projection):
     """
-    Get a world map from the geopandas library.
+    Get a world map from the geopandas library. The parsed map is cached as a Feather
+    file in CACHE_DIR so subsequent runs can skip reading the shapefile.
     
     Args:
-        map (str): The name of the map to load.
+        map_projection (str): The name of the map to load.
         
     Returns:
         world (geopandas.geodataframe.GeoDataFrame): A geopandas dataframe containing the world map.
     """
+    import geopandas as gpd
+
+    cache_path = os.path.join(CACHE_DIR, f'world_{map_projection}.feather')
+    if os.path.exists(cache_path):
+        try:
+            return gpd.read_feather(cache_path)
+        except ImportError:
+            # Without pyarrow the cache can't be read, but it may still be valid for other
+            # environments sharing it, so fall back to the shapefile and leave it alone.
+            pass
+        except (OSError, ValueError):
+            # An unreadable (e.g. truncated) cache is discarded and rebuilt from the shapefile.
+            _remove_quietly(cache_path)
+
     world = gpd.read_file(gpd.datasets.get_path(map_projection))
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.feather.tmp', dir=CACHE_DIR)
+        os.close(fd)
+        # Write to a temporary file first so other runs never see a partially written cache.
+        world.to_feather(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except (ImportError, OSError):
+        # Caching is only an optimisation: without pyarrow, or if the cache directory can't
+        # be written, the map is simply not cached.
+        if tmp_path is not None:
+            _remove_quietly(tmp_path)
     return world
 
-def pandas_to_geopandas(df, crs):
+def _remove_quietly(path):
+    """
+    Remove a file, ignoring any error in doing so.
+    
+    Args:
+        path (str): Path to the file to remove.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def histogram_2d(x, y, bins, weights=None, use_fast_histogram=False):
     """
-    Convert a pandas dataframe to a geopandas dataframe.
+    Compute a 2D histogram of the given coordinates over uniformly spaced bins spanning
+    the range of the data. numpy is used by default, as it reproduces the paper figure exactly.
+    fast-histogram is faster, but computes bin indices arithmetically, so points lying exactly
+    on a bin edge (common with rounded coordinates) may fall in a different bin.
     
     Args:
-        df (pandas.core.frame.DataFrame): A pandas dataframe.
-        crs (dict): The coordinate reference system to use.
+        x (numpy.ndarray): The x (longitude) coordinates.
+        y (numpy.ndarray): The y (latitude) coordinates.
+        bins (tuple): The number of bins along the y and x axes.
+        weights (numpy.ndarray): The weight of each coordinate. Default is None, giving each
+            coordinate a weight of one.
+        use_fast_histogram (bool): Use fast-histogram if it is installed. Default is False.
         
     Returns:
-        gdf (geopandas.geodataframe.GeoDataFrame): A geopandas dataframe.
+        heatmap (numpy.ndarray): A numpy array containing the binned (weighted) counts.
     """
-    geometry = [Point(xy) for xy in zip(df.Longitude_rounded, df.Latitude_rounded)]
-    gdf = gpd.GeoDataFrame(df, crs=crs, geometry=geometry)
-    return gdf
+    import numpy as np
+
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    if weights is not None:
+        weights = np.ascontiguousarray(weights, dtype=np.float64)
+
+    bounds = []
+    for values in (y, x):
+        low, high = values.min(), values.max()
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        bounds.append([low, high])
+
+    fast_histogram = None
+    if use_fast_histogram:
+        try:
+            import fast_histogram
+        except ImportError:
+            pass
+
+    if fast_histogram is None:
+        heatmap, _, _ = np.histogram2d(y, x, bins=bins, range=bounds, weights=weights)
+        return heatmap
+
+    # fast-histogram excludes the upper edge of the range whereas numpy includes it.
+    bounds = [[low, np.nextafter(high, np.inf)] for low, high in bounds]
+    return fast_histogram.histogram2d(y, x, range=bounds, bins=bins, weights=weights)
+
+def _gaussian_smooth(arr, sigma, mode, truncate=4.0):
+    """
+    Smooth a 2D array with an isotropic Gaussian. Small kernels are applied as two separable
+    1D passes, large kernels by FFT convolution of the padded array.
+    
+    Args:
+        arr (numpy.ndarray): The array to smooth.
+        sigma (float): Standard deviation of the Gaussian kernel.
+        mode (str): The scipy.ndimage boundary mode.
+        truncate (float): Truncate the kernel at this many standard deviations.
+        
+    Returns:
+        smoothed (numpy.ndarray): The smoothed array.
+    """
+    # As with ndimage.gaussian_filter, a sigma of (effectively) zero means no smoothing.
+    if sigma < 1e-15:
+        return arr
+
+    if sigma < FFT_SMOOTHING_THRESHOLD:
+        from scipy import ndimage
+
+        for axis in (0, 1):
+            arr = ndimage.gaussian_filter1d(arr, sigma, axis=axis, mode=mode, truncate=truncate)
+        return arr
+
+    if mode not in PAD_MODES:
+        raise ValueError(f'Unsupported smoothing mode: {mode}')
+
+    # scipy.signal is slow to import, so only do so when FFT convolution is needed.
+    import numpy as np
+    from scipy import signal
+
+    radius = int(truncate * sigma + 0.5)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+    kernel = np.outer(kernel, kernel).astype(arr.dtype)
+
+    padded = np.pad(arr, radius, mode=PAD_MODES[mode])
+    return signal.fftconvolve(padded, kernel, mode='valid')
+
+def aggregate_coordinates(df):
+    """
+    Count the occurrences of each unique latitude-longitude pair, so that the heatmap only
+    needs to bin each location once.
+    
+    Args:
+        df (pandas.core.frame.DataFrame): A pandas dataframe containing the latitude and longitude data.
+        
+    Returns:
+        agg (pandas.core.frame.DataFrame):
+            A pandas dataframe containing each unique location and its count.
+    """
+    agg = df.groupby(['Latitude_rounded', 'Longitude_rounded']).size().reset_index(name='Count')
+    return agg
 
 def generate_heatmap(df, args):
     """
-    Generate a heatmap from a geopandas dataframe using 2D histogram binning with smoothing.
+    Generate a heatmap from a pandas dataframe using 2D histogram binning with smoothing.
     Based on https://nbviewer.org/gist/perrygeo/c426355e40037c452434
     
     Args:
-        df (geopandas.geodataframe.GeoDataFrame): A geopandas dataframe containing the data.
+        df (pandas.core.frame.DataFrame):
+            A pandas dataframe containing the unique locations and their counts.
         args (argparse.Namespace): An argparse namespace containing the arguments.
     """
+    import numpy as np
 
-    coords = df.geometry.apply(lambda pt: pt.coords[0])
-    x, y = zip(*coords)
-    heatmap, _, _ = np.histogram2d(y, x, bins=args.bins)
+    x = df['Longitude_rounded'].to_numpy()
+    y = df['Latitude_rounded'].to_numpy()
+    weights = df['Count'].to_numpy()
+    heatmap = histogram_2d(x, y, args.bins,
+                           weights=weights,
+                           use_fast_histogram=args.fast_histogram).astype(np.float32, copy=False)
 
-    logheatmap = np.log(heatmap)
-    logheatmap[np.isneginf(logheatmap)] = 0
-    logheatmap = ndimage.filters.gaussian_filter(logheatmap, args.smoothing, mode=args.mode)
+    logheatmap = np.log(heatmap, where=heatmap > 0, out=np.zeros_like(heatmap))
+    logheatmap = _gaussian_smooth(logheatmap, args.smoothing, args.mode)
+    logheatmap = logheatmap.astype(np.float32, copy=False)
 
     return logheatmap
 
@@ -200,7 +352,10 @@ def overlay_heat_on_map(world, heat, args):
         heat (numpy.ndarray): A numpy array containing the heatmap data.
         args (argparse.Namespace): An argparse namespace containing the arguments.
     """
-    minx, miny, maxx, maxy = world.boundary.total_bounds
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+    minx, miny, maxx, maxy = world.total_bounds
 
     ax = world.boundary.plot(figsize=args.fig_size,
                              edgecolor=args.edgecolor,
@@ -226,11 +381,14 @@ def overlay_heat_on_map(world, heat, args):
 
     filename = f"{args.filename}.{args.format}"
     full_path = os.path.join(args.output, filename)
-    plt.savefig(full_path,
+    fig = ax.figure
+    fig.savefig(full_path,
                 dpi=args.dpi,
                 format=args.format,
                 bbox_inches=args.bbox_inches,
-                pad_inches=args.pad_inches)
+                pad_inches=args.pad_inches,
+                **get_save_kwargs(args.format))
+    plt.close(fig)
 
 def main():
     """
@@ -239,11 +397,17 @@ def main():
     """
     args = parse_args()
 
-    df = pd.read_csv(args.input)
-    gdf = pandas_to_geopandas(df, crs=args.crs)
+    # Figures are only written to file, so use the non-interactive Agg backend.
+    import matplotlib
+    matplotlib.use('Agg')
+
+    df = read_csv_to_df(args.input,
+                        usecols=['Longitude_rounded', 'Latitude_rounded'],
+                        dtype='float64')
+    df = aggregate_coordinates(df)
 
     world = get_world_map(args.map)
-    heatmap = generate_heatmap(gdf, args)
+    heatmap = generate_heatmap(df, args)
 
     overlay_heat_on_map(world, heatmap, args)
 
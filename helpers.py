@@ -0,0 +1,42 @@
+"""
+Shared helper functions used by the figure generation scripts for Surveying the Deep:
+A Review of Computer Vision in the Benthos (Trotter et al. 2025).
+"""
+
+def read_csv_to_df(path, usecols, dtype=None):
+    """
+    Read the given columns of a CSV file into a pandas dataframe, using the multithreaded
+    pyarrow parser if it is installed.
+    
+    Args:
+        path (str): Path to the CSV file.
+        usecols (list): The columns to read.
+        dtype (type or dict): Data type(s) to parse the columns as. Default is None.
+        
+    Returns:
+        df (pandas.core.frame.DataFrame): A pandas dataframe containing the requested columns.
+    """
+    import pandas as pd
+
+    try:
+        import pyarrow  # noqa: F401
+        engine = 'pyarrow'
+    except ImportError:
+        engine = 'c'
+    df = pd.read_csv(path, usecols=usecols, dtype=dtype, engine=engine)
+    return df
+
+def get_save_kwargs(image_format):
+    """
+    Get extra keyword arguments for saving a figure in the given format. PNGs are saved with
+    fast zlib compression, trading a slightly larger file for much quicker encoding.
+    
+    Args:
+        image_format (str): Format of the output image file.
+        
+    Returns:
+        save_kwargs (dict): Keyword arguments to pass to matplotlib's savefig.
+    """
+    if image_format.lower() == 'png':
+        return {'pil_kwargs': {'compress_level': 1}}
+    return {}
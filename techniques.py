@@ -20,8 +20,7 @@ Date:
 """
 import argparse
 import os
-import matplotlib.pyplot as plt
-import pandas as pd
+from helpers import get_save_kwargs, read_csv_to_df
 
 def parse_args():
     """
@@ -104,10 +103,13 @@ def format_df(df):
         df_techs (pandas.core.frame.DataFrame):
             A pandas dataframe containing the publication data with the techniques formatted.
     """
-    df_techs = df[['Year', 'Image_Processing', 'Machine_Learning', 'Deep_Learning']]
-    df_techs.columns = ['Year', 'Image Processing', 'Machine Learning', 'Deep Learning']
+    techniques = ['Image_Processing', 'Machine_Learning', 'Deep_Learning']
 
-    df_techs = df_techs.groupby('Year').sum()
+    # pivot_table sorts the value columns, so restore their order for stacking.
+    df_techs = df.pivot_table(index='Year', values=techniques, aggfunc='sum', observed=True)
+    df_techs = df_techs[techniques].rename(columns={'Image_Processing': 'Image Processing',
+                                                    'Machine_Learning': 'Machine Learning',
+                                                    'Deep_Learning': 'Deep Learning'})
     return df_techs
 
 def generate_stacked_barchart(df, args):
@@ -120,13 +122,15 @@ def generate_stacked_barchart(df, args):
             A pandas dataframe containing the publication data with the techniques formatted.
         args (argparse.Namespace): An argparse namespace containing the parsed arguments.
     """
+    import matplotlib.pyplot as plt
+
     show_legend = not args.no_show_legend
 
-    df.plot(kind='bar', stacked=True,
-            figsize=args.fig_size,
-            xlabel=args.xlabel,
-            ylabel=args.ylabel,
-            legend=show_legend)
+    ax = df.plot(kind='bar', stacked=True,
+                 figsize=args.fig_size,
+                 xlabel=args.xlabel,
+                 ylabel=args.ylabel,
+                 legend=show_legend)
 
     plt.legend(['Image Processing',
                 'Machine Learning',
@@ -138,8 +142,11 @@ def generate_stacked_barchart(df, args):
 
     filename = f"{args.filename}.{args.format}"
     full_path = os.path.join(args.output, filename)
-    plt.savefig(full_path, dpi=args.dpi, format=args.format,
-                bbox_inches=args.bbox_inches, pad_inches=args.pad_inches)
+    fig = ax.figure
+    fig.savefig(full_path, dpi=args.dpi, format=args.format,
+                bbox_inches=args.bbox_inches, pad_inches=args.pad_inches,
+                **get_save_kwargs(args.format))
+    plt.close(fig)
 
 def print_stats(df, after_year_only):
     """
@@ -154,9 +161,9 @@ def print_stats(df, after_year_only):
         df = df[df.index >= after_year_only]
         print(f'Stats after {after_year_only}:')
 
-    percent_ip = df['Image Processing'].sum() / df.sum().sum() * 100
-    percent_ml = df['Machine Learning'].sum() / df.sum().sum() * 100
-    percent_dl = df['Deep Learning'].sum() / df.sum().sum() * 100
+    col_sums = df[['Image Processing', 'Machine Learning', 'Deep Learning']].to_numpy().sum(axis=0)
+    total = col_sums.sum()
+    percent_ip, percent_ml, percent_dl = col_sums / total * 100
 
     print('Percentage of papers that used Image Processing:', percent_ip)
     print('Percentage of papers that used Machine Learning:', percent_ml)
@@ -169,7 +176,13 @@ def main():
     subdivided by techniques utilised.
     """
     args = parse_args()
-    df = pd.read_csv(args.input)
+
+    # Figures are only written to file, so use the non-interactive Agg backend.
+    import matplotlib
+    matplotlib.use('Agg')
+
+    df = read_csv_to_df(args.input,
+                        usecols=['Year', 'Image_Processing', 'Machine_Learning', 'Deep_Learning'])
     df = format_df(df)
 
     generate_stacked_barchart(df, args)